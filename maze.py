@@ -76,6 +76,12 @@ class Maze:
     def get_maze(self):
         return self.maze
 
+    # Replaces the maze with an existing one, in the same format as generate() produces
+    # Used to rebuild a maze that was generated elsewhere (e.g. sent to the route server)
+    #
+    def set_maze(self, maze):
+        self.maze = maze
+
     def set_path(self, path):
         self.path = path
     
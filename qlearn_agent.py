@@ -26,6 +26,7 @@ class QLearnAgent():
       self.num_states = None
       self.next_states = {}
       self.trained = False
+      self.epochs_trained = 0
 
     # Public Members
     #
@@ -88,14 +89,20 @@ class QLearnAgent():
       #
       self.Q = np.full((self.num_states, self.num_states), 0.0)
       self.trained = False
+      self.epochs_trained = 0
 
     # Trains the agent
     # initialize() should have been called before this function is called
+    # If max_epochs is set, gives up after that many epochs and leaves the agent untrained
     #
-    def train(self, gamma, min_change_per_epoch):
+    def train(self, gamma, min_change_per_epoch, max_epochs=None):
       print('Training...')
       epoch_iteration = 0
       while True:
+        if max_epochs is not None and epoch_iteration >= max_epochs:
+          print('Did not converge after {0} epochs'.format(epoch_iteration))
+          return
+
         previous_q = np.copy(self.Q)
 
         # Consider multiple states per epoch.
@@ -133,12 +140,19 @@ class QLearnAgent():
 
 
         # Normalize the Q matrix to avoid overflow
+        # If every walk started on the goal, nothing has been learned yet - don't divide by zero
         #
-        self.Q = self.Q / np.max(self.Q)
+        max_q = np.max(self.Q)
+        if max_q == 0:
+          epoch_iteration += 1
+          self.epochs_trained += 1
+          continue
+        self.Q = self.Q / max_q
 
         #Check stopping criteria
         diff = np.sum(np.abs(self.Q - previous_q))
         print('In epoch {0}, difference is {1}'.format(epoch_iteration, diff))
+        self.epochs_trained += 1
         if (diff < min_change_per_epoch):
           break
 
@@ -165,28 +179,57 @@ class QLearnAgent():
       #
       while(current_state != self.end_state and len(path) < self.num_states):
 
-        # For all of the next states, determine the state with the highest Q value
-        #
-        possible_next_states = self.next_states[current_state]
-        best_next_state = possible_next_states[0]
-        best_next_state_reward = self.Q[current_state][best_next_state]
-
-        for i in range(1, len(possible_next_states), 1):
-          potential_next_state = possible_next_states[i]
-          if (self.Q[current_state][potential_next_state] > best_next_state_reward):
-            best_next_state = potential_next_state
-            best_next_state_reward = self.Q[current_state][potential_next_state]
-        
-        # Move to that state, and add to path
+        # Move to the state with the highest Q value, and add to path
         #
-        current_state = best_next_state
+        current_state = self.__best_next_state(current_state)
         path.append(self.__state_to_maze_dims(current_state))
         
       return path
 
+    # Checks whether solve() reaches the goal from every state
+    # train() stops once Q stops changing, which can happen before every state has learned a way to the goal
+    #
+    def reaches_goal_from_every_state(self):
+      if not self.trained:
+        return False
+
+      # Following the best next state from any state either ends at the goal or loops forever
+      # Remember the outcome for every state on the way, so each state is only followed once
+      #
+      reaches_goal = {self.end_state: True}
+      for state in range(0, self.num_states, 1):
+        chain = []
+        chain_states = set()
+        current_state = state
+        while current_state not in reaches_goal and current_state not in chain_states:
+          chain.append(current_state)
+          chain_states.add(current_state)
+          current_state = self.__best_next_state(current_state)
+
+        result = reaches_goal.get(current_state, False)
+        for chain_state in chain:
+          reaches_goal[chain_state] = result
+        if not result:
+          return False
+      return True
+
     # Private Members
     #
 
+    # For all of the next states, determine the state with the highest Q value
+    #
+    def __best_next_state(self, current_state):
+      possible_next_states = self.next_states[current_state]
+      best_next_state = possible_next_states[0]
+      best_next_state_reward = self.Q[current_state][best_next_state]
+
+      for i in range(1, len(possible_next_states), 1):
+        potential_next_state = possible_next_states[i]
+        if (self.Q[current_state][potential_next_state] > best_next_state_reward):
+          best_next_state = potential_next_state
+          best_next_state_reward = self.Q[current_state][potential_next_state]
+      return best_next_state
+
     # Converts (y,x) coordinates to a numerical state
     #
     def __maze_dims_to_state(self, y, x):
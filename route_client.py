@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import maze
+import route_server
+
+# A stand-in client for load testing route_server.py
+#
+# Generates a set of random mazes, then sends batched solve requests for random starting points
+# over several concurrent connections, keeping several requests in flight on each one.
+# Once a maze has been solved, later requests for it send the agent_key from the response instead of the whole maze.
+# Prints client-side latency stats, followed by the server's own stats.
+#
+
+# Responses hold a full path for every start point in the batch, which can be well over the default 64 KiB stream line limit
+#
+MAX_RESPONSE_BYTES = 64 * 1024 * 1024
+
+# A single connection to the route server
+# Requests are pipelined, and responses are matched back to requests by id
+#
+class RouteClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.receive_task = asyncio.create_task(self.__receive())
+
+    @classmethod
+    async def connect(cls, unix_path=None, host='127.0.0.1', port=8765):
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_path, limit=MAX_RESPONSE_BYTES)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_RESPONSE_BYTES)
+        return cls(reader, writer)
+
+    # Public members
+    #
+
+    # Sends a request and waits for its response
+    #
+    async def request(self, request):
+        request = dict(request)
+        request['id'] = self.next_id
+        self.next_id += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request['id']] = future
+        self.writer.write((json.dumps(request, separators=(',', ':')) + '\n').encode('ascii'))
+        await self.writer.drain()
+        return await future
+
+    async def solve(self, maze_fields, end_point, start_points):
+        return await self.request({'op': 'solve', 'maze': maze_fields, 'end_point': end_point, 'start_points': start_points})
+
+    async def solve_cached(self, agent_key, start_points):
+        return await self.request({'op': 'solve', 'agent_key': agent_key, 'start_points': start_points})
+
+    async def stats(self):
+        return await self.request({'op': 'stats'})
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receive_task.cancel()
+
+    # Private members
+    #
+    async def __receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.waiting.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection to route server closed'))
+            self.waiting.clear()
+
+
+# Generates a random maze and end point, in the format the server expects
+#
+def generate_maze(num_rows, num_cols):
+    m = maze.Maze()
+    m.generate(num_rows, num_cols)
+    maze_fields = [[list(block) for block in row] for row in m.get_maze()]
+    end_point = [random.randint(0, num_rows-1), random.randint(0, num_cols-1)]
+    return maze_fields, end_point
+
+
+# Sends requests until the connection's share is used up, recording the round trip time of each one
+# Several of these run at once on each connection to keep requests pipelined
+#
+async def send_requests(client, mazes, remaining, agent_keys, batch_size, latencies, errors):
+    for i in remaining:
+        maze_index = random.randrange(len(mazes))
+        maze_fields, end_point = mazes[maze_index]
+        num_rows = len(maze_fields)
+        num_cols = len(maze_fields[0])
+        start_points = [[random.randint(0, num_rows-1), random.randint(0, num_cols-1)] for j in range(0, batch_size, 1)]
+
+        start_time = time.perf_counter()
+        response = None
+        if agent_keys is not None and maze_index in agent_keys:
+            response = await client.solve_cached(agent_keys[maze_index], start_points)
+
+        # Send the whole maze the first time, or if the server has since evicted the agent
+        #
+        if response is None or 'error' in response:
+            response = await client.solve(maze_fields, end_point, start_points)
+        latencies.record((time.perf_counter() - start_time) * 1000.0)
+
+        if 'error' in response:
+            errors.append(response['error'])
+        elif agent_keys is not None:
+            agent_keys[maze_index] = response['agent_key']
+
+
+async def run_connection(client, mazes, args, latencies, errors):
+    remaining = iter(range(0, args.requests, 1))
+    agent_keys = None if args.resend_mazes else {}
+    await asyncio.gather(*[send_requests(client, mazes, remaining, agent_keys, args.batch_size, latencies, errors) for i in range(0, args.pipeline, 1)])
+
+
+async def run(args):
+    mazes = [generate_maze(args.rows, args.cols) for i in range(0, args.mazes, 1)]
+    clients = [await RouteClient.connect(args.unix, args.host, args.port) for i in range(0, args.concurrency, 1)]
+
+    latencies = route_server.LatencyStats()
+    errors = []
+    start_time = time.perf_counter()
+    await asyncio.gather(*[run_connection(client, mazes, args, latencies, errors) for client in clients])
+    elapsed = time.perf_counter() - start_time
+
+    server_stats = await clients[0].stats()
+    for client in clients:
+        await client.close()
+
+    client_stats = latencies.get_stats()
+    print('Sent {0} requests ({1} paths) in {2:.2f}s: {3:.1f} requests/s'.format(
+        latencies.count, latencies.count * args.batch_size, elapsed, latencies.count / elapsed))
+    print('Client latency (ms): mean {0:.2f}, p50 {1:.2f}, p95 {2:.2f}, p99 {3:.2f}, max {4:.2f}'.format(
+        client_stats['mean_ms'], client_stats['p50_ms'], client_stats['p95_ms'], client_stats['p99_ms'], client_stats['max_ms']))
+    if errors:
+        print('{0} requests failed, first error: {1}'.format(len(errors), errors[0]))
+    print('Server stats: {0}'.format(json.dumps({'cache': server_stats['cache'], 'latency': server_stats['latency']}, indent=2)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test a running route_server.py with random mazes.')
+    parser.add_argument('--unix', default=None, help='Connect to this Unix socket path instead of TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--mazes', type=int, default=4, help='Number of distinct random mazes to query')
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--cols', type=int, default=6)
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent connections')
+    parser.add_argument('--requests', type=int, default=100, help='Number of requests sent per connection')
+    parser.add_argument('--pipeline', type=int, default=4, help='Number of requests kept in flight on each connection')
+    parser.add_argument('--batch-size', type=int, default=16, help='Number of start points per request')
+    parser.add_argument('--resend-mazes', action='store_true', help='Send the whole maze with every request instead of reusing agent keys')
+    args = parser.parse_args()
+
+    for name in ['mazes', 'rows', 'cols', 'concurrency', 'pipeline', 'requests', 'batch_size']:
+        if getattr(args, name) < 1:
+            parser.error('--{0} must be at least 1'.format(name.replace('_', '-')))
+    if args.rows * args.cols < 2:
+        parser.error('mazes must have at least two blocks')
+    return args
+
+
+# The main entry point of the client
+#
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
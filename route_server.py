@@ -0,0 +1,431 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import stat
+import time
+
+import maze
+import qlearn_agent
+
+# Room left in a request for everything other than the maze and start points
+#
+REQUEST_OVERHEAD_BYTES = 64 * 1024
+
+# A local server that answers path queries from trained Q Learning agents
+#
+# Agents are trained once per (maze, end point) pair and kept in memory, so downstream tools
+# can ask for paths from many starting points without importing the GUI or retraining.
+#
+# The protocol is newline-delimited JSON. Each request is a single line, and each response is a single
+# line carrying the same 'id'. Requests on a connection are processed concurrently, so responses may
+# come back out of order.
+#
+#   {"id": 1, "op": "solve", "maze": [[[0,0], [0,0], ...], ...], "end_point": [5,5], "start_points": [[0,0], [3,2]]}
+#   {"id": 2, "op": "solve", "agent_key": "<key returned by a previous solve>", "start_points": [[1,4]]}
+#   {"id": 3, "op": "stats"}
+#
+# 'maze' is the same structure produced by Maze.generate(): each block holds the coordinates of the block it is connected to.
+#
+
+# Keeps trained agents in memory, evicting the least recently used one when full
+# Concurrent requests for an agent that is still training wait on the same training run
+#
+class AgentCache:
+    def __init__(self, capacity, gamma, min_change_per_epoch, max_epochs, training_workers):
+        if capacity < 1:
+            raise ValueError('Cache capacity must be at least 1, got {0}'.format(capacity))
+        if training_workers < 1:
+            raise ValueError('Number of training workers must be at least 1, got {0}'.format(training_workers))
+        self.capacity = capacity
+        self.gamma = gamma
+        self.min_change_per_epoch = min_change_per_epoch
+        self.max_epochs = max_epochs
+        self.agents = collections.OrderedDict()
+        self.pending = {}
+
+        # Training runs on its own bounded pool, so a burst of new mazes queues there instead of tying up the server
+        #
+        self.training_executor = concurrent.futures.ThreadPoolExecutor(max_workers=training_workers, thread_name_prefix='train')
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    # Public members
+    #
+
+    # Computes the key used to identify the agent for a given maze and end point
+    #
+    def get_key(self, maze_fields, end_point):
+        serialized = json.dumps([maze_fields, end_point], separators=(',', ':'))
+        return hashlib.sha1(serialized.encode('ascii')).hexdigest()
+
+    # Returns the agent for a key that was previously loaded, or None if it is unknown or was evicted
+    #
+    def lookup(self, key):
+        agent = self.agents.get(key)
+        if agent is not None:
+            self.agents.move_to_end(key)
+            self.hits += 1
+        return agent
+
+    # Returns a trained agent for the given maze and end point, training one if needed
+    #
+    async def get_agent(self, key, maze_fields, end_point):
+        agent = self.lookup(key)
+        if agent is not None:
+            return agent
+
+        # Someone else is already training this agent - wait for them instead of training twice
+        #
+        if key in self.pending:
+            self.coalesced += 1
+            return await asyncio.shield(self.pending[key])
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.training_executor, self.__train_agent, maze_fields, end_point)
+        self.pending[key] = future
+
+        # Store the agent from a callback so it is cached even if the requester disconnects mid-training
+        #
+        future.add_done_callback(lambda f: self.__finish_training(key, f))
+        return await asyncio.shield(future)
+
+    def get_stats(self):
+        return {
+            'size': len(self.agents),
+            'capacity': self.capacity,
+            'training': len(self.pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions
+        }
+
+    # Private members
+    #
+
+    def __finish_training(self, key, future):
+        del self.pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        self.agents[key] = future.result()
+        while len(self.agents) > self.capacity:
+            self.agents.popitem(last=False)
+            self.evictions += 1
+
+    # Builds and trains a new agent. Runs on a worker thread, as training can take a while.
+    #
+    def __train_agent(self, maze_fields, end_point):
+        m = maze.Maze()
+        m.set_maze([[tuple(block) for block in row] for row in maze_fields])
+        m.set_end_point(tuple(end_point))
+
+        agent = qlearn_agent.QLearnAgent()
+        agent.initialize(m)
+
+        # Q can stop changing before every block has a way to the goal, so keep training until it does
+        # Failing here drops the pending entry, so the next request for this maze starts a fresh training run
+        #
+        while not agent.reaches_goal_from_every_state():
+            if agent.epochs_trained >= self.max_epochs:
+                raise RuntimeError('Agent could not reach the goal from every block within {0} epochs'.format(self.max_epochs))
+            agent.train(self.gamma, self.min_change_per_epoch, self.max_epochs - agent.epochs_trained)
+        return agent
+
+
+# Keeps a window of recent request latencies and summarizes them
+#
+class LatencyStats:
+    def __init__(self, window_size=10000):
+        self.samples = collections.deque(maxlen=window_size)
+        self.count = 0
+
+    def record(self, latency_ms):
+        self.samples.append(latency_ms)
+        self.count += 1
+
+    def get_stats(self):
+        if len(self.samples) == 0:
+            return {'count': self.count}
+
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'window': len(ordered),
+            'mean_ms': sum(ordered) / len(ordered),
+            'p50_ms': self.__percentile(ordered, 50),
+            'p95_ms': self.__percentile(ordered, 95),
+            'p99_ms': self.__percentile(ordered, 99),
+            'max_ms': ordered[-1]
+        }
+
+    # Nearest-rank percentile of an already sorted list
+    #
+    def __percentile(self, ordered, percent):
+        index = max(0, -(-len(ordered) * percent // 100) - 1)
+        return ordered[index]
+
+
+# Handles client connections and dispatches requests
+#
+class RouteServer:
+    def __init__(self, cache, max_blocks, max_batch):
+        self.cache = cache
+        self.max_blocks = max_blocks
+        self.max_batch = max_batch
+        self.latency = collections.defaultdict(LatencyStats)
+
+    # Public members
+    #
+    async def handle_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.__handle_line(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            # Finish answering everything that was sent before the client stopped writing
+            #
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError):
+            # ValueError is raised by readline() when a request is longer than the stream limit
+            #
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    # Private members
+    #
+    async def __handle_line(self, line, writer, write_lock):
+        start_time = time.perf_counter()
+        request_id = None
+        op = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object')
+            request_id = request.get('id')
+            op = request.get('op')
+            if op == 'solve':
+                response = await self.__solve(request)
+            elif op == 'stats':
+                response = self.__stats()
+            else:
+                raise ValueError('Unknown op: {0}'.format(op))
+        except Exception as e:
+            response = {'error': '{0}: {1}'.format(type(e).__name__, e)}
+
+        latency_ms = (time.perf_counter() - start_time) * 1000.0
+        self.latency[op if op in ('solve', 'stats') else 'invalid'].record(latency_ms)
+        response['id'] = request_id
+        response['latency_ms'] = latency_ms
+
+        async with write_lock:
+            writer.write((json.dumps(response, separators=(',', ':')) + '\n').encode('ascii'))
+            await writer.drain()
+
+    # Returns the path from each start point to the end point
+    # Duplicate start points in a batch are only solved once
+    # Solving a trained agent is cheap, so it runs inline instead of queueing behind training on a worker thread
+    # The whole request is validated before training starts, so a bad request never trains or caches an agent
+    #
+    async def __solve(self, request):
+        start_points = request.get('start_points')
+        if 'agent_key' in request:
+            key = request['agent_key']
+            if not isinstance(key, str):
+                raise ValueError('agent_key must be a string')
+            agent = self.cache.lookup(key)
+            if agent is None:
+                raise ValueError('Unknown agent_key {0}. It may have been evicted; resend the maze.'.format(key))
+            self.__validate_start_points(start_points, agent.num_states // agent.num_columns, agent.num_columns)
+        else:
+            maze_fields = request.get('maze')
+            end_point = request.get('end_point')
+            if maze_fields is None or end_point is None:
+                raise ValueError('solve needs either agent_key, or both maze and end_point')
+            key = self.cache.get_key(maze_fields, end_point)
+
+            # Only validate mazes that are not cached yet - validation is linear in the maze size
+            #
+            agent = self.cache.lookup(key)
+            if agent is None:
+                self.__validate_maze(maze_fields, end_point)
+            self.__validate_start_points(start_points, len(maze_fields), len(maze_fields[0]))
+            if agent is None:
+                agent = await self.cache.get_agent(key, maze_fields, end_point)
+
+        start_points = [tuple(p) for p in start_points]
+
+        solved = {s: agent.solve(s) for s in dict.fromkeys(start_points)}
+
+        # Agents are only cached once they reach the goal from every block, so this should never fail
+        # If it does, report it rather than hand back a path that goes nowhere
+        #
+        goal = (agent.end_state // agent.num_columns, agent.end_state % agent.num_columns)
+        for start_point, path in solved.items():
+            if tuple(path[-1]) != goal:
+                raise RuntimeError('Path from {0} did not reach the goal'.format(list(start_point)))
+        return {
+            'agent_key': key,
+            'paths': [[list(p) for p in solved[s]] for s in start_points]
+        }
+
+    def __stats(self):
+        return {
+            'cache': self.cache.get_stats(),
+            'latency': {op: stats.get_stats() for op, stats in self.latency.items()}
+        }
+
+    # Checks that the maze has the shape produced by Maze.generate()
+    # A disconnected maze can never converge, so it is rejected here rather than left to hit the training epoch limit
+    #
+    def __validate_maze(self, maze_fields, end_point):
+        if not isinstance(maze_fields, list) or len(maze_fields) == 0 or not isinstance(maze_fields[0], list):
+            raise ValueError('maze must be a non-empty list of rows')
+        num_rows = len(maze_fields)
+        num_cols = len(maze_fields[0])
+        if num_rows * num_cols < 2:
+            raise ValueError('maze must have at least two blocks')
+
+        # The agent keeps two (blocks x blocks) matrices, so memory and training time grow quickly with maze size
+        #
+        if num_rows * num_cols > self.max_blocks:
+            raise ValueError('maze has {0} blocks, the limit is {1}'.format(num_rows * num_cols, self.max_blocks))
+
+        for y in range(0, num_rows, 1):
+            if not isinstance(maze_fields[y], list) or len(maze_fields[y]) != num_cols:
+                raise ValueError('All maze rows must be lists of the same length')
+            for x in range(0, num_cols, 1):
+                block = maze_fields[y][x]
+                if not self.__is_point(block, num_rows, num_cols):
+                    raise ValueError('Invalid maze block {0} at {1}'.format(block, [y, x]))
+
+                # Every block except the top-left corner must be connected to one of its neighbors
+                #
+                distance = abs(block[0] - y) + abs(block[1] - x)
+                if (y == 0 and x == 0 and distance != 0) or ((y != 0 or x != 0) and distance != 1):
+                    raise ValueError('Invalid maze block {0} at {1}'.format(block, [y, x]))
+
+        # Every block must lead back to the top-left corner, or some states can never reach the goal
+        # Blocks already known to be connected end the walk early, so each block is only walked once
+        #
+        connected = {(0, 0)}
+        for y in range(0, num_rows, 1):
+            for x in range(0, num_cols, 1):
+                chain = []
+                point = (y, x)
+                while point not in connected:
+                    chain.append(point)
+                    if len(chain) > num_rows * num_cols:
+                        raise ValueError('Block {0} is not connected to the rest of the maze'.format([y, x]))
+                    point = tuple(maze_fields[point[0]][point[1]])
+                connected.update(chain)
+
+        if not self.__is_point(end_point, num_rows, num_cols):
+            raise ValueError('End point {0} is not a point in the maze'.format(end_point))
+
+    # Every start point gets its own path in the response, so the batch size bounds the response size
+    #
+    def __validate_start_points(self, start_points, num_rows, num_cols):
+        if start_points is None:
+            raise ValueError('start_points is required')
+        if not isinstance(start_points, list):
+            raise ValueError('start_points must be a list of [y, x] points')
+        if len(start_points) > self.max_batch:
+            raise ValueError('Request has {0} start points, the limit is {1}'.format(len(start_points), self.max_batch))
+        for start_point in start_points:
+            if not self.__is_point(start_point, num_rows, num_cols):
+                raise ValueError('Start point {0} is not a point in the maze'.format(start_point))
+
+    # Checks that a value is a [y, x] pair of integer coordinates inside a (num_rows x num_cols) maze
+    #
+    def __is_point(self, point, num_rows, num_cols):
+        if not isinstance(point, list) or len(point) != 2:
+            return False
+        for coordinate in point:
+            if not isinstance(coordinate, int) or isinstance(coordinate, bool):
+                return False
+        return 0 <= point[0] < num_rows and 0 <= point[1] < num_cols
+
+
+# Computes the longest request line the server accepts
+# Requests carry the whole maze, which can be well over the default 64 KiB stream line limit
+#
+def get_max_request_bytes(max_blocks, max_batch):
+    # Each block and start point is written as '[y, x], ', and every row adds its own brackets
+    #
+    bytes_per_point = (2 * len(str(max_blocks))) + 6
+    return (max_blocks * (bytes_per_point + 4)) + (max_batch * bytes_per_point) + REQUEST_OVERHEAD_BYTES
+
+
+async def serve(args):
+    cache = AgentCache(args.cache_size, args.gamma, args.min_change_per_epoch, args.max_epochs, args.training_workers)
+    server = RouteServer(cache, args.max_blocks, args.max_batch)
+    max_request_bytes = get_max_request_bytes(args.max_blocks, args.max_batch)
+
+    if args.unix is not None:
+        # Only replace a stale socket from a previous run - never a file that the path happens to point at
+        #
+        if os.path.lexists(args.unix):
+            if not stat.S_ISSOCK(os.lstat(args.unix).st_mode):
+                raise ValueError('{0} already exists and is not a socket'.format(args.unix))
+            os.remove(args.unix)
+        listener = await asyncio.start_unix_server(server.handle_connection, path=args.unix, limit=max_request_bytes)
+        print('Listening on {0}'.format(args.unix))
+    else:
+        listener = await asyncio.start_server(server.handle_connection, args.host, args.port, limit=max_request_bytes)
+        print('Listening on {0}:{1}'.format(args.host, args.port))
+
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        cache.training_executor.shutdown(wait=False, cancel_futures=True)
+        if args.unix is not None and os.path.lexists(args.unix) and stat.S_ISSOCK(os.lstat(args.unix).st_mode):
+            os.remove(args.unix)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve maze paths from cached, trained Q Learning agents.')
+    parser.add_argument('--unix', default=None, help='Listen on this Unix socket path instead of TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=16, help='Maximum number of trained agents kept in memory')
+    parser.add_argument('--max-blocks', type=int, default=256,
+                        help='Largest maze accepted, in blocks (rows x columns). Each cached agent needs about 16 * blocks^2 bytes.')
+    parser.add_argument('--max-batch', type=int, default=1024, help='Largest number of start points accepted in one solve request')
+    parser.add_argument('--training-workers', type=int, default=2, help='Maximum number of agents trained at the same time')
+    parser.add_argument('--gamma', type=float, default=0.8)
+    parser.add_argument('--min-change-per-epoch', type=float, default=0.001)
+    parser.add_argument('--max-epochs', type=int, default=1000, help='Give up training an agent after this many epochs')
+    args = parser.parse_args()
+    if args.max_blocks < 2:
+        parser.error('--max-blocks must be at least 2')
+    if args.max_batch < 1:
+        parser.error('--max-batch must be at least 1')
+    return args
+
+
+# The main entry point of the server
+#
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass